@@ -3,12 +3,13 @@ import sys
 import tarfile
 from shutil import which
 from threading import Thread
-from time import sleep
 
 import requests
 from Bio.Align.Applications import MuscleCommandline
 from tqdm import tqdm
 
+from progress import wait_with_elapsed
+
 
 class Muscle:
     """
@@ -171,17 +172,9 @@ class Muscle:
         t = Thread(target=self._run_muscle, args=(muscle,))
         t.start()
 
-        # Show a progress bar
-        pbar = tqdm(bar_format='[ALIGN] - Time elapsed:\t{elapsed}', )
-
-        # Update the progress bar
-        while t.is_alive():
-            pbar.update(1)
-            sleep(1)
-
-        # Close the progress bar
-        pbar.close()
-        t.join()
+        # Show the time elapsed until the alignment finishes
+        wait_with_elapsed(
+            'ALIGN', lambda timeout: t.join(timeout) or not t.is_alive())
 
     def _run_muscle(self, muscle: MuscleCommandline) -> None:
         """
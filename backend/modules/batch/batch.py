@@ -4,6 +4,7 @@ import sys
 import time
 from typing import Dict, List
 import zipfile
+from functools import lru_cache
 
 import requests
 from bs4 import BeautifulSoup
@@ -21,9 +22,11 @@ ESEARCH = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi{QUERY}"
 EFETCH = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi{QUERY}"
 
 
+@lru_cache(maxsize=128)
 def taxon_name_to_id(taxon_name: str) -> int:
     """
     Convert a taxon name to a taxon ID using the NCBI Taxonomy Browser API.
+    Results are cached for the life of the server process.
     """
     url = ESEARCH.format(QUERY=f"?db=taxonomy&term={taxon_name}&api_key={NCBI_API_KEY}")
     print(url)
@@ -100,9 +103,12 @@ def fetch_species(gene_id: List[int]) -> Dict[str, List[int]]:
     return species_dict
 
 
-def fetch_gene_ids(txid: int, gene_name: str) -> list:
+@lru_cache(maxsize=128)
+def fetch_gene_ids(txid: int, gene_name: str) -> tuple:
     """
     Fetch all gene IDs for a given taxonomy and gene name using the NCBI Gene API.
+    Results are cached for the life of the server process, so they are
+    returned as a tuple that callers cannot modify.
     """
     url = ESEARCH.format(QUERY=f"?db=gene&term={gene_name}[Gene Name]+AND+txid{txid}[Organism:exp]&retmax=100000&api_key={NCBI_API_KEY}")
     r = requests.get(url)
@@ -110,7 +116,7 @@ def fetch_gene_ids(txid: int, gene_name: str) -> list:
         raise Exception("Error fetching gene IDs from NCBI Gene.")
         
     # The gene IDs are under eSearchResult -> IdList -> Id.
-    return re.findall(r"<Id>(\d+)</Id>", r.text)
+    return tuple(re.findall(r"<Id>(\d+)</Id>", r.text))
 
 
 def fetch_fasta(nuc_id: str) -> str:
@@ -1,19 +1,27 @@
+import hashlib
 import os
+import shutil
 import subprocess
-from threading import Thread
-from time import sleep
+import tempfile
 
 from Bio import SearchIO
 from Bio.Blast.Applications import NcbiblastnCommandline
-from tqdm import tqdm
 
 from genbank import GenBank, GenBankDDL
+from net import Cache
+from progress import wait_with_elapsed
+
+# The nt database changes daily, so BLAST hits are only reused for a day.
+BLAST_CACHE_TTL = 24 * 60 * 60
 
 
 def blastn(query, params=None, db='nt', out="blastn.out.txt", ms=100, ev=0.05,
-           ws=11, rw=2, pn=-3, go=5, ge=2, tl=18, tt='coding') -> None:
+           ws=11, rw=2, pn=-3, go=5, ge=2, tl=18, tt='coding',
+           cache=True) -> None:
     """
-    Run a blastn search on the given query.
+    Run a blastn search on the given query. The hits of an identical search
+    from the last BLAST_CACHE_TTL seconds are reused instead of searching
+    again.
     :param params: The parameters to use for the BLAST search.
     :param query: The query file.
     :param db: The database to search.
@@ -27,6 +35,7 @@ def blastn(query, params=None, db='nt', out="blastn.out.txt", ms=100, ev=0.05,
     :param ge: The gap extension cost.
     :param tl: The template length.
     :param tt: The template type.
+    :param cache: Whether to reuse the hits of an identical earlier search.
     """
     # Create the BLAST command to run
     blastn_cline = NcbiblastnCommandline(query=query,
@@ -52,26 +61,83 @@ def blastn(query, params=None, db='nt', out="blastn.out.txt", ms=100, ev=0.05,
     else:
         blastn_cline = _setup_blast_params(blastn_cline, {})
 
-    # Create a new thread to run the BLAST search
-    t = Thread(target=_blast_thread, args=(blastn_cline,))
-    t.start()
-
-    # Show an indeterminate progress bar
-    pbar = tqdm(bar_format='[BLAST] - Time elapsed:\t{elapsed}', )
+    # Check for the hits of an identical earlier search
+    store = Cache() if cache else None
+    key = f"blast:{_blast_key(query, blastn_cline)}"
+    hits = store.get(key, ttl=BLAST_CACHE_TTL) if store is not None else None
+    if hits:
+        print("Reusing the cached hits of an identical BLAST search. Use -nc "
+              "to search again.")
+        with open(out, 'w') as f:
+            f.write(hits)
+    else:
+        # Remove any results left by an earlier search, so that a failed
+        # search cannot be mistaken for this one
+        if os.path.exists(out):
+            os.remove(out)
 
-    # Update the progress bar
-    while t.is_alive():
-        pbar.update(1)
-        sleep(1)
+        returncode = _run_blast(blastn_cline)
 
-    # Close the progress bar
-    pbar.close()
-    t.join()
+        # Save the hits for next time, but only from a successful search
+        # that found something
+        if store is not None and returncode == 0 and \
+                os.path.exists(out) and os.path.getsize(out) > 0:
+            with open(out, 'r') as f:
+                store.set(key, f.read())
 
     # Download the BLAST results
     _download_blast_results(out)
 
 
+def _run_blast(blastn: NcbiblastnCommandline) -> int:
+    """
+    Run the BLAST search as a child process, showing the time elapsed.
+    Returns the exit status of the search.
+    :param blastn: The BLAST command to run.
+    """
+    process = subprocess.Popen(str(blastn), shell=True)
+
+    # Show the time elapsed until the search finishes. Waiting on the
+    # process itself means no thread is needed to watch it.
+    wait_with_elapsed('BLAST', lambda timeout: _exited(process, timeout))
+
+    return process.returncode
+
+
+def _exited(process: subprocess.Popen, timeout: float) -> bool:
+    """
+    Wait up to the timeout for a child process to exit. Returns whether it
+    has exited.
+    :param process: The child process.
+    :param timeout: The number of seconds to wait.
+    """
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return False
+    return True
+
+
+def _blast_key(query: str, blastn: NcbiblastnCommandline) -> str:
+    """
+    Return an MD5 digest of the query sequences and every BLAST option that
+    affects the result, identifying the search.
+    :param query: The query file.
+    :param blastn: The BLAST command to run.
+    """
+    digest = hashlib.md5()
+    with open(query, 'rb') as f:
+        for data in iter(lambda: f.read(1 << 20), b''):
+            digest.update(data)
+
+    # The file names do not change the hits, so leave them out
+    options = sorted(str(parameter) for parameter in blastn.parameters
+                     if parameter.is_set and
+                     parameter.names[0] not in ('-query', '-out'))
+    digest.update(''.join(options).encode())
+    return digest.hexdigest()
+
+
 def _download_blast_results(out: str) -> None:
     """
     Download the BLAST results.
@@ -89,14 +155,6 @@ def _download_blast_results(out: str) -> None:
     gb.download(f'{out}')
 
 
-def _blast_thread(blastn: NcbiblastnCommandline) -> None:
-    """
-    Thread to run the BLAST search.
-    :param blastn: The BLAST command to run.
-    """
-    subprocess.call(str(blastn), shell=True)
-
-
 def _setup_blast_params(executable: NcbiblastnCommandline,
                         params: dict) -> NcbiblastnCommandline:
     """
@@ -141,23 +199,28 @@ def read_blast(blast_file: str) -> dict:
 
 
 def blast_by_species_and_symbol(species: list, symbol: list,
-                                output: str) -> None:
+                                output: str, cache: bool = True) -> None:
     """
     Run a BLAST search by downloading the sequence for the given symbol and
     species.
     :param species: The species to search for.
     :param symbol: The symbol to search for.
     :param output: The output file.
+    :param cache: Whether to reuse previously cached NCBI responses.
     """
     # Search for the symbol in the GenBank database
-    gb = GenBank(symbol, species)
+    gb = GenBank(symbol, species, cache=cache)
     data = gb.search()
 
-    # Download the sequence
-    gb.download(filename="btemp", records=data)
-
-    # Run the BLAST search
-    blastn('btemp.fasta', out=output)
-
-    # Delete the temporary FASTA file
-    os.remove('btemp.fasta')
+    # Download the sequences into a folder private to this search, so that
+    # concurrent searches do not overwrite each other's query
+    temp = tempfile.mkdtemp(prefix='bridge-blast-')
+    try:
+        query = os.path.join(temp, 'query')
+        gb.download(filename=query, records=data)
+
+        # Run the BLAST search on every sequence in one submission
+        blastn(f'{query}.fasta', out=output, cache=cache)
+    finally:
+        # Delete the temporary folder
+        shutil.rmtree(temp, ignore_errors=True)
@@ -1,13 +1,6 @@
 import os
 from argparse import ArgumentParser
 
-from align import Muscle
-from blast import blastn, blast_by_species_and_symbol
-from ensembl import Ensembl
-from filter import filter_summary, filter_blast
-from genbank import GenBank, GenBankDDL
-from iq import Tree
-
 
 def setup_parser() -> ArgumentParser:
     """
@@ -38,6 +31,16 @@ def setup_parser() -> ArgumentParser:
     parser.add_argument('-es', dest='ensembl', action='store_const',
                         const=True, default=False, required=False,
                         help='Specify for a Ensembl search.')
+    parser.add_argument('-u', '--uids_file', required=False,
+                        help='A file of GenBank gene UIDs, one per line, to '
+                             'download without searching. Only use with -gb.')
+    parser.add_argument('-nc', '--no_cache', dest='no_cache',
+                        action='store_const', const=True, default=False,
+                        required=False, help='Ignore previously cached NCBI '
+                                             'responses, including the '
+                                             'hits of earlier BLAST '
+                                             'searches, and fetch them '
+                                             'again.')
 
     # BLAST arguments
     parser.add_argument('-b', dest='blast', action='store_const',
@@ -62,6 +65,11 @@ def setup_parser() -> ArgumentParser:
     parser.add_argument('-t', '--taxonomy', required=False,
                         help='The taxonomic rank to show distribution by. \
                             Only use with -a.')
+    parser.add_argument('-nd', '--no_display', dest='no_display',
+                        action='store_const', const=True, default=False,
+                        required=False, help='Save the charts and tree '
+                                             'without opening a window. '
+                                             'Only use with -a.')
 
     return parser
 
@@ -118,25 +126,41 @@ def main() -> None:
             print('Use -o <output>')
             exit()
 
+    # The analysis modules pull in Biopython, lxml and matplotlib, so each is
+    # only imported by the branch that uses it.
+
     # Check if the user is searching GenBank
     if args.genbank:
-        if args.species and args.gene:
+        from genbank import GenBank
+
+        if args.uids_file:
+            # Read the gene UIDs, skipping any blank lines
+            with open(args.uids_file, 'r') as f:
+                uids = [line.strip() for line in f if line.strip()]
+
+            # Fetch the records for the UIDs directly from GenBank
+            gb = GenBank([], [], cache=not args.no_cache)
+            data = gb.search_from_uids(uids)
+            gb.summarize(args.output, data)
+            gb.download(args.output)
+        elif args.species and args.gene:
             # Split the species and gene(s) into a list (in-case multiple)
             genes = args.gene.split(',')
             species = args.species.split(',')
 
             # Search for the symbol in the GenBank database
-            gb = GenBank(genes, species)
+            gb = GenBank(genes, species, cache=not args.no_cache)
             data = gb.search()
             gb.summarize(args.output, data)
             gb.download(args.output)
         else:
             print('Please specify a species and gene to search for.')
-            print('Use -s <species> -g <gene>')
+            print('Use -s <species> -g <gene> or -u <uids_file>')
             exit()
 
     # Check if the user is searching BLAST
     if args.blast:
+        from blast import blastn, blast_by_species_and_symbol
 
         # Check if custom parameters have been specified
         params = None
@@ -150,21 +174,25 @@ def main() -> None:
         if args.file:
             # User is searching by file
             if args.output:
-                blastn(args.file, out=args.output, params=params)
+                blastn(args.file, out=args.output, params=params,
+                       cache=not args.no_cache)
             else:
-                blastn(args.file, params=params)
+                blastn(args.file, params=params, cache=not args.no_cache)
         else:
             # User is searching by name and gene symbol
             if args.species and args.gene and args.output:
                 genes = args.gene.split(',')
                 species = args.species.split(',')
 
-                blast_by_species_and_symbol(species, genes, output=args.output)
+                blast_by_species_and_symbol(species, genes, output=args.output,
+                                            cache=not args.no_cache)
 
         exit()
 
     # Check if the user is searching Ensembl
     if args.ensembl:
+        from ensembl import Ensembl
+
         if args.species and args.gene:
             genes = args.gene.split(',')
             species = args.species.split(',')
@@ -180,12 +208,15 @@ def main() -> None:
 
     # Check if the user is filtering the BLAST results
     if args.filter:
+        from filter import filter_summary, filter_blast
+
         if args.file:
             if args.blast_filter:
                 # Open the BLAST results
                 filtered = filter_blast(args.file, args.filter)
 
                 # Download the filtered results
+                from genbank import GenBankDDL
                 gb = GenBankDDL(records=filtered)
                 gb.download(filename=args.output)
             else:
@@ -211,6 +242,8 @@ def main() -> None:
 
     # Check if the user is aligning the sequences
     if args.align:
+        from align import Muscle
+        from iq import Tree
 
         # If a filter is not given, use the default
         if not args.filter:
@@ -230,7 +263,8 @@ def main() -> None:
 
             # Run the output through IQ-TREE
             tree = Tree(input=muscle.output, output=f"{muscle.output}-tree",
-                        rank=args.taxonomy)
+                        rank=args.taxonomy, cache=not args.no_cache,
+                        interactive=not args.no_display)
 
             # Check if IQ-TREE exists
             if not tree.check_installed():
@@ -1,10 +1,20 @@
 import json
+import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from bs4 import BeautifulSoup
 
+from net import MAX_WORKERS, RateLimiter
+
+# A shared session so that every request to Ensembl reuses open connections.
+SESSION = requests.Session()
+
+# Ensembl's REST API allows up to 15 requests per second.
+_RATE = RateLimiter(15)
+
 
 class EMBLFile:
     """
@@ -85,11 +95,13 @@ class Ensembl:
     SEQUENCE2 = "http://rest.ensembl.org/sequence/region/{SPECIES}"
     SEQUENCE = "http://rest.ensembl.org/sequence/id"
 
-    def __init__(self, genes=None, species=None):
+    def __init__(self, genes=None, species=None,
+                 session: requests.Session = SESSION):
         """
         Initialize a new Ensembl object.
         :param genes: A list of genes to search for.
         :param species: A list of species to search for.
+        :param session: The session to send requests to Ensembl with.
         """
         if genes is not None and species is not None:
             self.genes = genes
@@ -100,6 +112,7 @@ class Ensembl:
             self.accessions = None
 
         self._acc_seq = False
+        self._session = session
 
     def search(self) -> list:
         """
@@ -137,7 +150,8 @@ class Ensembl:
             seq = results[0][result]["sequence"]
             seq = [seq[i:i + 80] for i in range(0, len(seq), 80)]
             re_ann += "\n".join(seq) + "\n"
-        with open(f"{alignment.split('.')[0]}-searched.fasta", "w") as f:
+        with open(f"{os.path.splitext(alignment)[0]}-searched.fasta",
+                  "w") as f:
             f.write(re_ann)
 
         return results
@@ -150,21 +164,22 @@ class Ensembl:
 
         # Check if a species is given.
         if self.species:
-            for species in self.species:
-                for gene in self.genes:
-                    # Fetch the record from Ensembl.
-                    record = self.LOOKUP.format(SPECIES=species.replace(" ",
-                                                                        "_"),
-                                                GENE=gene)
-                    r = requests.get(record)
+            # Look up every gene in every species at once.
+            pairs = [(species, gene) for species in self.species
+                     for gene in self.genes]
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                responses = executor.map(lambda pair: self._lookup(*pair),
+                                         pairs)
+                for r in responses:
                     if r.status_code == 200:
                         results.append(r.json())
                     else:
                         print("Error finding the gene.")
         else:
-            # Split the accessions into groups of 100.
-            accessions = [self.accessions[i:i + 100]
-                          for i in range(0, len(self.accessions), 100)]
+            # Split the unique accessions into groups of 100.
+            unique = list(dict.fromkeys(self.accessions))
+            accessions = [unique[i:i + 100]
+                          for i in range(0, len(unique), 100)]
 
             # Search for the accessions.
             for accession in accessions:
@@ -174,9 +189,9 @@ class Ensembl:
                 }
                 data = {"ids": accession}
                 start_time = time.time()
-                r = requests.post(self.LOOKUP_ACC,
-                                  headers=headers,
-                                  data=json.dumps(data))
+                r = self._session.post(self.LOOKUP_ACC,
+                                       headers=headers,
+                                       data=json.dumps(data))
                 print(f"Time taken: {time.time() - start_time}")
 
                 if r.status_code == 200:
@@ -190,23 +205,35 @@ class Ensembl:
 
         return results
 
+    def _lookup(self, species: str, gene: str) -> requests.Response:
+        """
+        Fetch the record of a gene in a species from Ensembl.
+        :param species: The species to search in.
+        :param gene: The gene to search for.
+        """
+        record = self.LOOKUP.format(SPECIES=species.replace(" ", "_"),
+                                    GENE=gene)
+        _RATE.wait()
+        return self._session.get(record)
+
     def _get_acc_seqs(self, results: list) -> None:
         """
         Get the sequences for the accessions.
         :param results: The results to add the sequences to.
         """
-        # Split the accessions into groups of 50.
-        accessions_seq = [self.accessions[i:i + 50]
-                          for i in range(0, len(self.accessions), 50)]
+        # Split the unique accessions into groups of 50.
+        unique = list(dict.fromkeys(self.accessions))
+        accessions_seq = [unique[i:i + 50]
+                          for i in range(0, len(unique), 50)]
         for accession in accessions_seq:
             headers = {
                 "Content-Type": "application/json",
                 "Accept": "application/json"
             }
             data = {"ids": accession}
-            r = requests.post(self.SEQUENCE,
-                              headers=headers,
-                              data=json.dumps(data))
+            r = self._session.post(self.SEQUENCE,
+                                   headers=headers,
+                                   data=json.dumps(data))
 
             if r.status_code == 200:
                 # Go through the results and add them to the respective entry.
@@ -258,17 +285,14 @@ class Ensembl:
         }
         fasta_headers = self._get_headers(species)
 
-        for organism in species:
-            # Make the POST request.
-            data = {
-                "ids": [f"{gene[0].split('.')[0]}"
-                        for gene in species[organism]],
-                "format": "fasta",
-                "type": "cds"
-            }
-            r = requests.post(self.SEQUENCE,
-                              headers=headers,
-                              data=json.dumps(data))
+        # Make the POST requests for every organism at once.
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            responses = list(executor.map(
+                lambda organism: self._post_sequences(species[organism],
+                                                      headers),
+                species))
+
+        for organism, r in zip(species, responses):
             if r.status_code == 200:
                 # Parse the results.
                 results = self._parse_fasta(r.json(), headers=fasta_headers)
@@ -279,6 +303,23 @@ class Ensembl:
                       "are valid Ensembl sequence IDs.")
                 exit(1)
 
+    def _post_sequences(self, genes: list,
+                        headers: dict) -> requests.Response:
+        """
+        Request the coding sequences of an organism's genes from Ensembl.
+        :param genes: The (ID, description) pairs of the genes.
+        :param headers: The headers to send with the request.
+        """
+        data = {
+            "ids": [f"{gene[0].split('.')[0]}" for gene in genes],
+            "format": "fasta",
+            "type": "cds"
+        }
+        _RATE.wait()
+        return self._session.post(self.SEQUENCE,
+                                  headers=headers,
+                                  data=json.dumps(data))
+
     def _species_to_genes(self, results: list) -> dict:
         """
         Return a dictionary of species mapped to their genes-of-interest.
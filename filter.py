@@ -1,3 +1,5 @@
+from itertools import chain
+
 import requests
 from bs4 import BeautifulSoup
 
@@ -13,7 +15,6 @@ def filter_summary(results: list, filter: str) -> list:
     :param filter: The name of the taxon to filter by.
     """
     # Loop through each line in the results and check the species lineage.
-    removed = 0
     filter_upper = filter.upper()
 
     # Get tuples of where each entry starts and ends
@@ -41,14 +42,10 @@ def filter_summary(results: list, filter: str) -> list:
             lineage = [x.strip().upper() for x in lineage]
 
     # Remove entries that are not in the filter lineage
-    res = []
-    for entry in entries:
-        if not entry[2]:
-            removed += 1
-        else:
-            res += results[entry[0]:entry[1]]
-
-    res.insert(0, f'Removed {removed} results not in lineage {filter}\n\n')
+    removed = sum(1 for entry in entries if not entry[2])
+    res = [f'Removed {removed} results not in lineage {filter}\n\n']
+    res.extend(chain.from_iterable(results[i1:i2]
+                                   for i1, i2, keep in entries if keep))
 
     return res
 
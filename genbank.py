@@ -1,14 +1,29 @@
 import os
-import time
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 
+import requests
 from Bio import Entrez
-from dotenv import load_dotenv
 from tqdm import tqdm
 
-load_dotenv()
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
 
-EMAIL = os.getenv("EMAIL")
-API_KEY = os.getenv("NCBI_API_KEY")
+from ncbi import (BATCH_SIZE, HISTORY_BATCH_SIZE, SESSION, epost, eutils,
+                  iter_records)
+from net import MAX_WORKERS, Cache
+
+# Templates for the organisms and records listed in a summary file.
+_SEP = "-" * 80 + "\n"
+_ORGANISM_TMPL = "{organism}\nLineage: {lineage}\n" + _SEP
+_RECORD_TMPL = "\t({uid}) {symbol}\n\t{description}\n" + _SEP
+
+# Matches the gene ID of a record line in a summary file, e.g. "\t(1234) ABC".
+_SUMMARY_GENE_ID = re.compile(rb'^.\((\d+)\)', re.MULTILINE)
 
 
 class GenBank:
@@ -19,18 +34,22 @@ class GenBank:
     DOWNLOAD = "https://api.ncbi.nlm.nih.gov/datasets/v1/gene/" \
                "download?filename={FILE}"
 
-    def __init__(self, genes: list, species: list):
+    def __init__(self, genes: list, species: list, cache: bool = True,
+                 session: requests.Session = SESSION):
         """
         Initialize a new GenBank object.
         :param genes: A list of genes to search for.
         :param species: A list of species to search for.
+        :param cache: Whether to reuse previously downloaded NCBI responses.
+        :param session: The session to send requests to NCBI with.
         """
         self.genes = genes
         self.species = species
 
+        self._cache = Cache() if cache else None
+
+        self._session = session
         self.entrez = Entrez
-        self.entrez.email = EMAIL
-        self.entrez.api_key = API_KEY
 
     def search(self) -> list:
         """
@@ -40,6 +59,16 @@ class GenBank:
         results = self._fetch(raw_results)
         return results
 
+    def search_from_uids(self, uids: list) -> list:
+        """
+        Fetch the GenBank records for already known gene UIDs, skipping the
+        search entirely.
+        :param uids: A list of gene UIDs to fetch.
+        """
+        raw_results = [{'uid': str(uid), 'gene_input': str(uid),
+                        'organism_input': ""} for uid in uids]
+        return self._fetch(raw_results)
+
     def download(self, filename: str, records=None) -> None:
         """
         Download the fasta files.
@@ -55,18 +84,20 @@ class GenBank:
         else:
             gene_ids = self._download_from_summary(filename)
 
-        # Use Biopython EFetch to download the fasta files for the genes.
-        with self.entrez.efetch(db="gene", id=gene_ids, rettype="xml",
-                                retmode="xml") as handle:
+        # Use EFetch to download the gene records.
+        r = eutils("efetch", {'db': "gene", 'id': ",".join(gene_ids),
+                              'retmode': "xml"}, session=self._session)
+        with BytesIO(r.content) as handle:
             # Grab the mRNA products
             mrnas = []
             records = self.entrez.parse(handle)
             for record in records:
 
-                egene = record["Entrezgene_locus"]
+                # Loci and products are optional, so skip any that are absent.
+                egene = record.get("Entrezgene_locus", [])
 
                 for accession in egene:
-                    for entry in accession["Gene-commentary_products"]:
+                    for entry in accession.get("Gene-commentary_products", []):
 
                         val = entry["Gene-commentary_type"].attributes["value"]
                         if val == "mRNA":
@@ -74,28 +105,25 @@ class GenBank:
 
         accessions = list(set(mrnas))
 
-        handle.close()
-
         # Download the sequences
-        with self.entrez.efetch(db="nuccore", id=accessions, rettype="fasta",
-                                retmode="text") as handle:
+        r = eutils("efetch", {'db': "nuccore", 'id': ",".join(accessions),
+                              'rettype': "fasta", 'retmode': "text"},
+                   stream=True, session=self._session)
 
-            # Write the sequences to a file.
-            with open(f"{filename}.fasta", "w") as f:
-                f.write(handle.read())
+        # Stream the sequences to a file.
+        with open(f"{filename}.fasta", "wb") as f:
+            for chunk in r.iter_content(chunk_size=1 << 16):
+                f.write(chunk)
 
     def _download_from_summary(self, filename) -> list:
         """
         Parse the gene IDs from the summary file.
         :param filename: The name of the file containing results to download.
         """
-        # Open the summary file.
-        with open(f"{filename}-summary.txt", "r") as f:
-            lines = f.readlines()
-
-        # Parse the gene IDs from the summary.
-        gene_ids = [line.split()[0].strip("()") for line in lines
-                    if line[1] == "("]
+        # Parse the gene IDs from the summary in a single pass.
+        with open(f"{filename}-summary.txt", "rb") as f:
+            gene_ids = [gid.decode() for gid in
+                        _SUMMARY_GENE_ID.findall(f.read())]
 
         # Move the summary file to the data directory.
         os.mkdir(f"./{filename}")
@@ -125,157 +153,196 @@ class GenBank:
             # Create a filename based on the genes and species.
             filename = f"{len(self.genes)}-genes-{len(self.species)}-species"
 
-        summary = ""
-        by_organisms = {}
+        # Group the found records by organism and set aside the failures.
+        by_organisms = defaultdict(list)
         failed = []
-        for i in range(len(records)):
-
-            if records[i]['uid'] is not None:
-                try:
-                    by_organisms[records[i]['organism']].append(records[i])
-                except KeyError:
-                    by_organisms[records[i]['organism']] = [records[i]]
+        for record in records:
+            if record['uid'] is None:
+                failed.append(record)
             else:
-                failed.append(records[i])
+                by_organisms[record['organism']].append(record)
 
-        # Summarize the successful records.
-        summary = self._summarize_success(by_organisms, summary)
-
-        # Summarize the failed records.
-        summary = self._summarize_failed(failed, summary)
+        # Summarize the successful records, then the failed records.
+        summary = self._summarize_success(by_organisms)
+        summary.extend(self._summarize_failed(failed))
 
         with open(f"{filename}-summary.txt", "w") as f:
-            f.write(summary)
+            f.write("".join(summary))
 
-    def _summarize_success(self, by_organisms: dict, summary: str) -> str:
+    def _summarize_success(self, by_organisms: dict) -> list:
         """
-        Summarize the successful GenBank records.
+        Summarize the successful GenBank records. Returns the lines of the
+        summary.
         :param by_organisms: A dictionary of records by organism.
-        :param summary: The summary string to append to.
-        """
-        for organism in by_organisms:
-            summary += f"{organism}\n"
-            summary += f"Lineage: {by_organisms[organism][0]['lineage']}\n"
-            summary += "-" * 80 + "\n"
-            for record in by_organisms[organism]:
-                summary += f"\t({record['uid']}) {record['symbol']}\n"
-                summary += f"\t{record['description']}\n"
-                summary += "-" * 80 + "\n"
+        """
+        summary = []
+        for organism, records in by_organisms.items():
+            summary.append(_ORGANISM_TMPL.format(
+                organism=organism, lineage=records[0]['lineage']))
+            summary.extend(_RECORD_TMPL.format_map(record)
+                           for record in records)
         return summary
 
-    def _summarize_failed(self, failed: list, summary: str) -> str:
+    def _summarize_failed(self, failed: list) -> list:
         """
-        Summarize the failed GenBank records.
+        Summarize the failed GenBank records. Returns the lines of the
+        summary.
         :param failed: A list of failed records.
-        :param summary: The summary string to append to.
         """
+        summary = []
         if len(failed) > 0:
-            summary += "Failed to find the following genes:\n"
+            summary.append("Failed to find the following genes:\n")
             for record in failed:
-                summary += f"\t{record['gene_input']} " \
-                           f"{record['organism_input']}\n"
+                summary.append(f"\t{record['gene_input']} "
+                               f"{record['organism_input']}\n")
         return summary
 
     def _search(self) -> list:
         """
-        Use Biopython's ESearch module to query GenBank.
+        Use NCBI's ESearch utility to query GenBank.
         """
-        results = []
-        for species in tqdm(self.species,
-                            bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} '
-                                       'species have been examined.'):
-            for gene in self.genes:
-                handle = self.entrez.esearch(db="gene",
-                                             term=f"{gene}[GENE] AND "
-                                                  f"{species}[ORGN]")
-                record = self.entrez.read(handle)
-
-                # If the gene was not found, add a default value to the results.
-                if record['Count'] == '0':
-                    results.append({
-                        'uid': None,
-                        'gene_input': gene,
-                        'organism_input': species
-                    })
-                else:
-                    results.append({
-                        'uid': record['IdList'][0],
-                        'gene_input': gene,
-                        'organism_input': species
-                    })
-                handle.close()
+        queries = [(gene, species) for species in self.species
+                   for gene in self.genes]
+
+        # ESearch takes one term per request, so send them concurrently.
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = list(tqdm(executor.map(lambda q: self._search_one(*q),
+                                             queries),
+                                total=len(queries),
+                                bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} '
+                                           'searches have been completed.'))
         return results
 
+    def _search_one(self, gene: str, species: str) -> dict:
+        """
+        Search GenBank for a single gene in a single species.
+        :param gene: The gene to search for.
+        :param species: The species to search in.
+        """
+        key = f"esearch:{gene}:{species}"
+        if self._cache is not None:
+            result = self._cache.get(key)
+            if result is not None:
+                return result
+
+        r = eutils("esearch", {'db': "gene",
+                               'term': f"{gene}[GENE] AND {species}[ORGN]",
+                               'retmode': "json"},
+                   session=self._session)
+        record = _loads(r.content)['esearchresult']
+
+        # If the gene was not found, the UID is left empty.
+        uid = record['idlist'][0] if record['count'] != '0' else None
+        result = {
+            'uid': uid,
+            'gene_input': gene,
+            'organism_input': species
+        }
+        if self._cache is not None:
+            self._cache.set(key, result)
+        return result
+
     def _fetch(self, raw: list) -> list:
         """
-        Use Biopython's EFetch module to fetch the GenBank records.
+        Use NCBI's EFetch utility to fetch the GenBank records.
         :param raw: The raw results from the ESearch module.
         """
-        results = []
-
-        # Set a cooldown to prevent being rate-limited.
-        if len(raw) > 500:
-            cooldown = 2
+        # Only genes that were found need to be fetched, and only once each.
+        uids = list(dict.fromkeys(result['uid'] for result in raw
+                                  if result['uid'] is not None))
+
+        # Reuse any records that have already been fetched.
+        parsed = {}
+        if self._cache is not None:
+            for uid in uids:
+                record = self._cache.get(f"efetch:{uid}")
+                if record is not None:
+                    parsed[uid] = record
+            uids = [uid for uid in uids if uid not in parsed]
+
+        # Too many UIDs for a URL are uploaded once and fetched by page.
+        if len(uids) > HISTORY_BATCH_SIZE:
+            history = epost("gene", uids, session=self._session)
+            size = HISTORY_BATCH_SIZE
         else:
-            cooldown = 1
-
-        for result in tqdm(raw, bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt}'
-                                           ' records have been fetched.'):
+            history = None
+            size = BATCH_SIZE
+        batches = [(uids[i:i + size], i) for i in range(0, len(uids), size)]
+
+        # Fetch the batches concurrently and map each record to its UID.
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, \
+                tqdm(total=len(uids),
+                     bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} records '
+                                'have been fetched.') as pbar:
+            fetched = executor.map(
+                lambda batch: self._fetch_batch(*batch, history=history),
+                batches)
+            for (batch, _), records in zip(batches, fetched):
+                for record in records:
+                    uid = record['uid']
+                    parsed[uid] = record
+                    if self._cache is not None:
+                        self._cache.set(f"efetch:{uid}", record)
+                pbar.update(len(batch))
+
+        # Pair the records back up with the original search results.
+        results = []
+        for result in raw:
             if result['uid'] is None:
                 results.append(result)
+            elif result['uid'] in parsed:
+                results.append(parsed[result['uid']])
             else:
-                handle = self.entrez.efetch(db="gene", id=result['uid'],
-                                            retmode="xml")
-                self._parse_record(self.entrez.read(handle)[0])
-                results.append(self.record)
-                handle.close()
-            time.sleep(cooldown)
+                # NCBI did not return a record for this UID.
+                results.append({**result, 'uid': None})
         return results
 
-    def _parse_record(self, record) -> None:
+    def _fetch_batch(self, uids: list, start: int, history=None) -> list:
+        """
+        Fetch and parse the GenBank records for a batch of UIDs in one
+        request.
+        :param uids: The UIDs to fetch.
+        :param start: The position of the batch within all the UIDs.
+        :param history: The history parameters the UIDs were posted under,
+        if they were uploaded with EPost.
+        """
+        params = {'db': "gene", 'retmode': "xml"}
+        if history is None:
+            params['id'] = ",".join(uids)
+        else:
+            params.update(history, retstart=start, retmax=len(uids))
+        data = eutils("efetch", params, session=self._session).content
+        return [self._parse_record(record)
+                for record in iter_records(data, tag="Entrezgene")]
+
+    def _parse_record(self, record) -> dict:
         """
         Parse the GenBank record for the desired information.
+        :param record: An Entrezgene XML element.
         """
-        # Try to get the description, if it exists.
-        try:
-            desc = record['Entrezgene_summary']
-        except KeyError:
-            desc = None
-
-        lineage_info = record['Entrezgene_source']['BioSource'] \
-            ['BioSource_org']
-        organism = lineage_info['Org-ref']['Org-ref_taxname']
-        lineage = lineage_info['Org-ref']['Org-ref_orgname']['OrgName'] \
-            ['OrgName_lineage']
-
-        gene_info = record['Entrezgene_gene']['Gene-ref']
-        gene = gene_info['Gene-ref_locus']
-
-        # Try to get the name, synonyms, and gene ID, if they exist.
-        try:
-            name = gene_info['Gene-ref_desc']
-        except KeyError:
-            name = None
-        try:
-            synonyms = gene_info['Gene-ref_syn']
-        except KeyError:
-            synonyms = None
-        try:
-            gid = record['Entrezgene_locus'][0]['Gene-commentary_products'] \
-                [0]['Gene-commentary_accession']
-        except KeyError:
-            gid = None
-
-        self.record = {
-            'uid': record['Entrezgene_track-info']['Gene-track']
-            ['Gene-track_geneid'],
+        org = record.find('Entrezgene_source/BioSource/BioSource_org/Org-ref')
+        gene_info = record.find('Entrezgene_gene/Gene-ref')
+
+        # Optional fields are left as None if they do not exist.
+        synonyms = [syn.text for syn in
+                    gene_info.iterfind('Gene-ref_syn/Gene-ref_syn_E')]
+        locus = record.find('Entrezgene_locus/Gene-commentary')
+        gid = None
+        if locus is not None:
+            gid = locus.findtext('Gene-commentary_products/Gene-commentary/'
+                                 'Gene-commentary_accession')
+
+        return {
+            'uid': record.findtext('Entrezgene_track-info/Gene-track/'
+                                   'Gene-track_geneid'),
             'gid': gid,
-            'name': name,
-            'symbol': gene,
-            'synonyms': synonyms,
-            'description': desc,
-            'organism': organism,
-            'lineage': lineage
+            'name': gene_info.findtext('Gene-ref_desc'),
+            'symbol': gene_info.findtext('Gene-ref_locus'),
+            'synonyms': synonyms or None,
+            'description': record.findtext('Entrezgene_summary'),
+            'organism': org.findtext('Org-ref_taxname'),
+            'lineage': org.findtext('Org-ref_orgname/OrgName/'
+                                    'OrgName_lineage')
         }
 
 
@@ -284,32 +351,42 @@ class GenBankDDL:
     A class for downloading sequence data, given a list of GenBank records.
     """
 
-    def __init__(self, records: list):
+    def __init__(self, records: list, session: requests.Session = SESSION):
         """
         Initialize the direct-download class.
         :param records: A list of GenBank records.
+        :param session: The session to send requests to NCBI with.
         """
         self.records = records
-        self.entrez = Entrez
-        self.entrez.email = EMAIL
-        self.entrez.api_key = API_KEY
+        self._session = session
 
     def download(self, filename: str) -> None:
         """
-        Download the GenBank records using Biopython's EFetch module.
+        Download the GenBank records using NCBI's EFetch utility.
         :param filename: The name of the file to save the records to.
         """
-        for record in tqdm(self.records, bar_format='{l_bar}{bar}| {n_fmt}/'
-                                                    '{total_fmt} records have '
-                                                    'been downloaded.'):
-            handle = self.entrez.efetch(db="nucleotide", id=record,
-                                        rettype="fasta", retmode="text")
-
-            with open(f"{filename}.fasta", "a") as f:
-                f.write(handle.read())
-
-            handle.close()
-
-            time.sleep(0.20)
+        batches = [self.records[i:i + BATCH_SIZE]
+                   for i in range(0, len(self.records), BATCH_SIZE)]
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, \
+                open(f"{filename}.fasta", "a") as f, \
+                tqdm(total=len(self.records),
+                     bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt} records '
+                                'have been downloaded.') as pbar:
+            for batch, fasta in zip(batches,
+                                    executor.map(self._fetch_batch, batches)):
+                f.write(fasta)
+                pbar.update(len(batch))
 
         print(f"Downloaded {len(self.records)} records to {filename}.fasta.")
+
+    def _fetch_batch(self, records: list) -> str:
+        """
+        Fetch the FASTA sequences for a batch of GenBank records in one
+        request.
+        :param records: The accessions of the records to fetch.
+        """
+        r = eutils("efetch", {'db': "nucleotide", 'id': ",".join(records),
+                              'rettype': "fasta", 'retmode': "text"},
+                   session=self._session)
+        return r.text
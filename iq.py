@@ -1,21 +1,57 @@
+import hashlib
+import mmap
 import os
+import re
+import shutil
 import subprocess
 import sys
 import tarfile
+import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
+from functools import cached_property
 from shutil import which
-from threading import Thread
-from time import sleep
 
 import requests
-from Bio import Entrez
 from Bio import Phylo
-from matplotlib import pyplot as plt
 from tqdm import tqdm
 
-EMAIL = os.getenv("EMAIL")
-API_KEY = os.getenv("NCBI_API_KEY")
+from ncbi import (BATCH_SIZE, HISTORY_BATCH_SIZE, epost, eutils,
+                  iter_records)
+from net import MAX_WORKERS, Cache
+from progress import wait_with_elapsed
+
+# Set when there is no display to open windows on, e.g. in CI.
+HEADLESS = bool(os.getenv("BRIDGE_HEADLESS"))
+# Overrides the pinned SHA-256 of the IQ-TREE archive for this platform.
+IQTREE_SHA256 = os.getenv("IQTREE_SHA256")
+
+# The number of parts large IQ-TREE archives are downloaded in at once.
+DOWNLOAD_PARTS = 4
+
+# Lineages of records that are not natural organisms, such as synthetic
+# constructs. These are left out of the rank distribution.
+_BAD_LINEAGES = frozenset({'other sequences', 'artificial sequences'})
+
+# The database cross-references of a GenBank record's source feature.
+_SOURCE_XREFS = ("GBSeq_feature-table/GBFeature[GBFeature_key='source']/"
+                 "GBFeature_quals/GBQualifier[GBQualifier_name='db_xref']/"
+                 "GBQualifier_value")
+
+# A FASTA header line, capturing the accession before the first space. This
+# is the only place the accession of a header is parsed.
+_HEADER = re.compile(rb'^>([^ \r\n]*)[^\r\n]*', re.MULTILINE)
+
+# The folder each IQ-TREE release extracts to, the executable within it, and
+# the SHA-256 of the release archive. Archives are never installed without a
+# digest to check them against, so a release whose digest is still None can
+# only be installed by setting IQTREE_SHA256.
+IQTREE_RELEASES = {
+    'win32': ('iqtree-2.0.6-Windows', 'iqtree.exe', None),
+    'darwin': ('iqtree-2.0.6-MacOSX', 'iqtree', None),
+    'linux': ('iqtree-2.0.6-Linux', 'iqtree', None),
+}
 
 
 class Tree:
@@ -23,27 +59,30 @@ class Tree:
     A phylogenetic tree generated from a multiple sequence alignment.
     """
 
-    def __init__(self, input: str, output: str, rank: str):
+    def __init__(self, input: str, output: str, rank: str,
+                 cache: bool = True, interactive: bool = True):
         """
         Initialize the Tree object.
         :param input: The input alignment file.
         :param output: The output tree file.
         :param rank: The taxonomic rank to use for the tree.
+        :param cache: Whether to reuse previously downloaded taxonomy records.
+        :param interactive: Whether to open the charts and tree in a window.
         """
         self.input = input
         self.output = output
         self.rank = rank
+        self.interactive = interactive and not HEADLESS
+
+        self._cache = Cache() if cache else None
 
         self.lineages = {}
         self.ranks = {}
         self.accessions = {}
+        self.taxids = {}
 
         self.program = ""
 
-        self.entrez = Entrez
-        self.entrez.email = EMAIL
-        self.entrez.api_key = API_KEY
-
     def check_installed(self) -> bool:
         """
         Check if IQ-TREE is available in the user's PATH.
@@ -86,20 +125,14 @@ class Tree:
             return True
 
         # Request the data for the Windows executable
-        exe = 'https://github.com/Cibiv/IQ-TREE/releases/download/v2.0.6/\
-        iqtree-2.0.6-Windows.zip'
-        r = requests.get(exe, allow_redirects=True)
+        exe = ('https://github.com/Cibiv/IQ-TREE/releases/download/v2.0.6/'
+               'iqtree-2.0.6-Windows.zip')
+        r = requests.get(exe, stream=True, allow_redirects=True)
 
         # Check if the request was successful
         if r.status_code == 200:
-            # Save the executable
-            self._download_archive(r, 'zip')
-
-            # Extract the archive
-            self._extract_archive("zip")
-
-            # Move the executable
-            self._move_executable()
+            # Download, verify and install the executable
+            self._unpack(r, 'zip')
 
             # Set the program path
             self.program = os.path.abspath('iqtree.exe')
@@ -120,20 +153,14 @@ class Tree:
             return True
 
         # Request the data for the archive
-        url = f'https://github.com/Cibiv/IQ-TREE/releases/download/v2.0.6/iqtre\
-        e-{specific}'
-        r = requests.get(url, allow_redirects=True)
+        url = ('https://github.com/Cibiv/IQ-TREE/releases/download/v2.0.6/'
+               f'iqtree-{specific}')
+        r = requests.get(url, stream=True, allow_redirects=True)
 
         # Check if the request was successful
         if r.status_code == 200:
-            # Save the archive
-            self._download_archive(r, archive)
-
-            # Extract the archive
-            self._extract_archive(archive)
-
-            # Move the executable
-            self._move_executable()
+            # Download, verify and install the executable
+            self._unpack(r, archive)
 
             # Set the program path
             self.program = os.path.abspath('iqtree')
@@ -142,108 +169,211 @@ class Tree:
 
         return False
 
-    def _download_archive(self, r: requests.Response,
-                          archive: str) -> None:
+    def _unpack(self, r: requests.Response, archive: str) -> None:
         """
-        Download the IQ-TREE archive from the GitHub repository.
+        Download and extract the IQ-TREE archive into a temporary folder, and
+        only move the executable into place once the archive is verified.
+        The temporary folder is always removed afterwards.
         :param r: Response made from the GitHub.
         :param archive: The file archive type (zip, tarball).
         """
+        release = IQTREE_RELEASES[sys.platform][0]
+        if _expected_sha256() is None:
+            r.close()
+            raise ValueError(f'No SHA-256 is pinned for {release}, so it '
+                             f'cannot be verified. Set IQTREE_SHA256 to the '
+                             f'digest of the archive, or install IQ-TREE on '
+                             f'your PATH.')
+
+        temp = tempfile.mkdtemp(prefix='bridge-iqtree-')
+        try:
+            if archive == 'tar.gz':
+                # Extract the tarball as it downloads
+                self._stream_tarball(r, temp)
+            else:
+                # Save and extract the archive
+                self._download_archive(r, archive, temp)
+                self._extract_archive(archive, temp)
+
+            # Move the executable
+            self._move_executable(temp)
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
+
+    def _download_archive(self, r: requests.Response, archive: str,
+                          folder: str) -> None:
+        """
+        Download the IQ-TREE archive from the GitHub repository. Large
+        archives are split into parts that are downloaded at the same time,
+        if the server allows it.
+        :param r: Response made from the GitHub.
+        :param archive: The file archive type (zip, tarball).
+        :param folder: The folder to save the archive in.
+        """
         total_size = int(r.headers.get('content-length', 0))
-        block_size = 1024
+        path = os.path.join(folder, f'iqtree.{archive}')
+        digest = hashlib.sha256()
         t = tqdm(total=total_size, unit='iB', unit_scale=True)
-        with open(f'iqtree.{archive}', 'wb') as f:
-            for data in r.iter_content(block_size):
-                t.update(len(data))
-                f.write(data)
+        if r.headers.get('accept-ranges') == 'bytes' and \
+                total_size >= DOWNLOAD_PARTS << 20:
+            # Drop the single stream and request each part separately
+            r.close()
+            self._download_parts(r.url, path, total_size, t)
+
+            # The parts arrive out of order, so hash the file afterwards
+            with open(path, 'rb') as f:
+                for data in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(data)
+        else:
+            with open(path, 'wb', buffering=1 << 20) as f:
+                for data in r.iter_content(1 << 16):
+                    t.update(len(data))
+                    digest.update(data)
+                    f.write(data)
         t.close()
 
-    def _extract_archive(self, archive: str) -> None:
+        self._verify_checksum(digest)
+
+    def _download_parts(self, url: str, path: str, total_size: int,
+                        t: tqdm) -> None:
         """
-        Extract the IQ-TREE archive.
-        :param archive: The file extension of the archive (zip, tarball).
+        Download a file in DOWNLOAD_PARTS byte ranges over separate
+        connections, writing each range in place.
+        :param url: The URL of the file.
+        :param path: Where to save the file.
+        :param total_size: The size of the file in bytes.
+        :param t: The progress bar to update.
         """
-        # Check if archive is .zip
-        if archive == "zip":
-            # Extract and remove the archive
-            with zipfile.ZipFile('iqtree.zip', 'r') as zip_ref:
-                zip_ref.extractall()
-            os.remove('iqtree.zip')
+        size = -(-total_size // DOWNLOAD_PARTS)
+        spans = [(start, min(start + size, total_size) - 1)
+                 for start in range(0, total_size, size)]
 
-        # If not, archive is .tar.gz
-        else:
-            # Extract and remove the archive
-            with tarfile.open('iqtree.tar.gz', 'r:gz') as tar:
-                tar.extractall()
-            os.remove('iqtree.tar.gz')
+        # Allocate the whole file up front so the parts can be written
+        # in any order
+        with open(path, 'wb') as f:
+            f.truncate(total_size)
+
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_PARTS) as executor:
+            list(executor.map(
+                lambda span: self._download_part(url, path, span, t), spans))
 
-    def _move_executable(self) -> None:
+    def _download_part(self, url: str, path: str, span: tuple,
+                       t: tqdm) -> None:
         """
-        Move the IQ-TREE executable up from the bin folder to the project root.
-        After moving, delete the originally extracted folder.
+        Download one byte range of a file into the same range of the file on
+        disk.
+        :param url: The URL of the file.
+        :param path: Where the file is saved.
+        :param span: The first and last byte of the range.
+        :param t: The progress bar to update.
         """
-        if sys.platform == 'win32':
-            # Windows
-
-            # Move the executable and remove the folder
-            os.system('move iqtree-2.0.6-Windows\\bin\\iqtree.exe .')
-            os.system('rmdir /s /q iqtree-2.0.6-Windows')
+        start, end = span
+        r = requests.get(url, headers={'Range': f'bytes={start}-{end}'},
+                         stream=True)
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise requests.HTTPError(f'Range request not honoured for {url}',
+                                     response=r)
+
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            for data in r.iter_content(1 << 16):
+                t.update(len(data))
+                f.write(data)
 
-        elif sys.platform == 'darwin':
-            # Mac
+    def _stream_tarball(self, r: requests.Response, folder: str) -> None:
+        """
+        Extract the IQ-TREE tarball straight from the response without
+        saving the archive to disk first. The archive can only be verified
+        once it has been read, so no member may be written outside the
+        folder.
+        :param r: Response made from the GitHub.
+        :param folder: The folder to extract the tarball into.
+        """
+        total_size = int(r.headers.get('content-length', 0))
+        digest = hashlib.sha256()
+        r.raw.decode_content = True
+        with tqdm.wrapattr(r.raw, 'read', total=total_size) as raw:
+            reader = _HashingReader(raw, digest)
+            # 'r|gz' reads the archive as a stream, so it never needs to seek
+            with tarfile.open(fileobj=reader, mode='r|gz') as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(folder, filter='data')
+                else:
+                    tar.extractall(folder, _checked_members(tar, folder))
+
+            # tarfile stops at the end-of-archive marker, so hash the rest
+            while reader.read(1 << 16):
+                pass
+
+        self._verify_checksum(digest)
+
+    def _verify_checksum(self, digest) -> None:
+        """
+        Compare the SHA-256 of the downloaded archive against the pinned
+        digest for this platform, or IQTREE_SHA256 if it is set. Raises a
+        ValueError on a mismatch.
+        :param digest: The SHA-256 hash of the archive.
+        """
+        expected = _expected_sha256()
+        if digest.hexdigest() != expected:
+            raise ValueError(f'The IQ-TREE archive does not match its '
+                             f'checksum (expected {expected}, got '
+                             f'{digest.hexdigest()}).')
 
-            # Move the executable and remove the folder
-            os.system('mv iqtree-2.0.6-MacOSX/bin/iqtree .')
-            os.system('rm -r iqtree-2.0.6-MacOSX')
+    def _extract_archive(self, archive: str, folder: str) -> None:
+        """
+        Extract the IQ-TREE archive. Only zip archives are saved to disk
+        first, since they need to be seekable.
+        :param archive: The file extension of the archive (zip).
+        :param folder: The folder the archive was saved in and is extracted
+        into.
+        """
+        with zipfile.ZipFile(os.path.join(folder, f'iqtree.{archive}'),
+                             'r') as zip_ref:
+            zip_ref.extractall(folder)
 
-        elif sys.platform == 'linux':
-            # Linux
+    def _move_executable(self, folder: str) -> None:
+        """
+        Move the IQ-TREE executable up from the bin folder of the extracted
+        release to the project root.
+        :param folder: The folder the release was extracted into.
+        """
+        release, executable, _ = IQTREE_RELEASES[sys.platform]
 
-            # Move the executable and remove the folder
-            os.system('mv iqtree-2.0.6-Linux/bin/iqtree .')
-            os.system('rm -r iqtree-2.0.6-Linux')
+        # The temporary folder may be on another file system, so the
+        # executable is moved rather than renamed
+        shutil.move(os.path.join(folder, release, 'bin', executable),
+                    executable)
 
     def run(self) -> None:
         """
         Run IQ-TREE on the input alignment.
         """
-        # Create a thread to grab the phylogenies of each sequence
-        t = Thread(target=self._get_phylogenies)
-        t.start()
-
-        # Show a progress bar
-        pbar = tqdm(bar_format='[PHYLOGENIES] - Time elapsed:\t{elapsed}',)
-
-        # Update the progress bar
-        while t.is_alive():
-            pbar.update(1)
-            sleep(1)
-
-        # Close the progress bar
-        pbar.close()
-        t.join()
-
-        # Display the pie chart
-        self._display_pie_chart()
+        # Grab the species of each sequence
+        self._get_species()
 
         # Rename the FASTA headers in the alignment file
         self._rename_headers()
 
-        # Create a thread to run IQ-TREE
-        t = Thread(target=self._run_iqtree)
-        t.start()
+        # Run IQ-TREE while the phylogenies of each sequence are resolved
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            tree = executor.submit(self._run_iqtree)
+            phylogenies = executor.submit(self._get_phylogenies)
 
-        # Show a progress bar
-        pbar = tqdm(bar_format='[TREE] - Time elapsed:\t{elapsed}',)
+            # Show the time elapsed until IQ-TREE finishes. The bar keeps
+            # the top line so that the [PHYLOGENIES] bar below it does not
+            # draw over it.
+            wait_with_elapsed(
+                'TREE', lambda timeout: wait([tree], timeout).done,
+                position=0)
 
-        # Update the progress bar
-        while t.is_alive():
-            pbar.update(1)
-            sleep(1)
+        # Raise any error from either stage
+        tree.result()
+        phylogenies.result()
 
-        # Close the progress bar
-        pbar.close()
-        t.join()
+        # Display the pie chart
+        self._display_pie_chart()
 
         # Remove non-tree files
         os.remove(f'{self.input}.bionj')
@@ -256,103 +386,152 @@ class Tree:
         # Display the tree
         self._display_tree()
 
-    def _rename_headers(self) -> None:
+    @cached_property
+    def accession_list(self) -> list:
         """
-        Rename the FASTA headers in the input alignment file.
+        The accession of each sequence in the input alignment, in order.
         """
-        # Open the input alignment
-        with open(self.input, 'r') as f:
-            lines = f.readlines()
-
-        # Remove non-header lines
-        headers = [line for line in lines if line[0] == '>']
-
-        # Grab the accessions for each entry
-        accessions = [header.split(' ')[0][1:] for header in headers]
-
-        # Create new headers
-        headers = []
-        for accession in accessions:
-            # Grab the species
-            species = self.accessions[accession]
+        if os.path.getsize(self.input) == 0:
+            return []
 
-            # Create the new header
-            header = f'>{species.replace(" ", "_")}_({accession})\n'
-            headers.append(header)
+        with open(self.input, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return [match.group(1).decode() for match in _HEADER.finditer(mm)]
 
-        # Replace the headers in the input alignment
-        for i in range(len(lines)):
-            if lines[i][0] == '>':
-                lines[i] = headers.pop(0)
-
-        # Write the new alignment
-        with open(self.input, 'w') as f:
-            f.writelines(lines)
+    def _rename_headers(self) -> None:
+        """
+        Rename the FASTA headers in the input alignment file.
+        """
+        if os.path.getsize(self.input) == 0:
+            return
+
+        # Copy the alignment into a temporary file, rewriting each header.
+        # The regex finds the headers in C, so the sequence lines between
+        # them are copied in large slices rather than line by line.
+        temp = f'{self.input}.tmp'
+        with open(self.input, 'rb') as fin, open(temp, 'wb') as fout, \
+                mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = 0
+            for match in _HEADER.finditer(mm):
+                fout.write(mm[end:match.start()])
+
+                # Grab the accession and its species
+                accession = match.group(1).decode()
+                species = self.accessions[accession].replace(' ', '_')
+                fout.write(f'>{species}_({accession})'.encode())
+                end = match.end()
+            fout.write(mm[end:])
+
+        # Replace the input alignment with the renamed one
+        os.replace(temp, self.input)
+
+    def _get_species(self) -> None:
+        """
+        Get the species, lineage and taxonomy ID of the sequences in the input
+        alignment from their GenBank records.
+        """
+        accessions = self.accession_list
+
+        # Upload the accessions once and fetch their records back by page,
+        # so the request is not limited by URL length
+        posted = epost('nucleotide', accessions)
+        for start in range(0, len(accessions), HISTORY_BATCH_SIZE):
+            r = eutils('efetch', {**posted, 'db': 'nucleotide',
+                                  'retstart': start,
+                                  'retmax': HISTORY_BATCH_SIZE,
+                                  'retmode': 'xml'})
+            self._parse_records(r.content)
 
     def _get_phylogenies(self) -> None:
         """
-        Get the phylogenies of the sequences in the input alignment.
+        Get the phylogenies of the sequences in the input alignment. The
+        species must already have been fetched with _get_species.
         """
-        # Open the input alignment
-        with open(self.input, 'r') as f:
-            lines = f.readlines()
-
-        # Remove non-header lines
-        headers = [line for line in lines if line[0] == '>']
-
-        # Grab the accessions for each entry
-        accessions = [header.split(' ')[0][1:] for header in headers]
-
-        # Request NCBI for the records
-        records = self.entrez.efetch(db='nucleotide', id=accessions,
-                                     retmode='xml')
-        self._parse_records(records)
+        # Find the ranked lineage of each distinct taxon
+        taxids = {self.taxids[accession] for accession in self.lineages
+                  if accession in self.taxids}
+        lineages = self._fetch_lineages(list(taxids))
 
         # Count the number of species that fall under each specified rank
         for accession in self.lineages:
-            # Grab the lineage
-            taxonomies = self.lineages[accession]
-
-            # Request NCBI for the taxonomy record
-            taxonomy_ids = []
-            for taxonomy in taxonomies[4:]:
-                record = self.entrez.esearch(db='taxonomy', term=taxonomy)
-                record = Entrez.read(record)
-                # Grab the taxonomy ID
-                taxonomy_id = record['IdList'][0]
-                taxonomy_ids.append(taxonomy_id)
-
-            # Grab the taxonomy records
-            if not taxonomy_ids:
-                continue
-            records = self.entrez.efetch(db='taxonomy', id=taxonomy_ids,
-                                            retmode='xml')
-            records = Entrez.read(records)
-
-            # Find which record is the specified rank
-            for record in records:
-                if record['Rank'] == self.rank.lower():
-                    # Grab the rank
-                    rank = record['ScientificName']
-                    # Add the Order to the dictionary
-                    if rank in self.ranks:
-                        self.ranks[rank] += 1
-                    else:
-                        self.ranks[rank] = 1
-                    break
-
-            sleep(0.25)
+            lineage = lineages.get(self.taxids.get(accession), {})
+            rank = lineage.get(self.rank.lower())
+            if rank is not None:
+                self.ranks[rank] = self.ranks.get(rank, 0) + 1
 
         # Sort the dictionary by the number of species
         self.ranks = dict(sorted(self.ranks.items(), key=lambda item: item[1],
                                  reverse=True))
 
+    def _fetch_lineages(self, taxids: list) -> dict:
+        """
+        Map each taxonomy ID to its ranked lineage, a dictionary of each rank
+        to the name of the taxon at that rank. Lineages already in the cache
+        are not requested again.
+        :param taxids: The taxonomy IDs to look up.
+        """
+        lineages = {}
+        if self._cache is not None:
+            for taxid in taxids:
+                lineage = self._cache.get(f"taxonomy:{taxid}")
+                if lineage is not None:
+                    lineages[taxid] = lineage
+            taxids = [taxid for taxid in taxids if taxid not in lineages]
+
+        if not taxids:
+            return lineages
+
+        # Upload the IDs once so the request is not limited by URL length
+        posted = epost('taxonomy', taxids)
+
+        # Fetch the records back a page at a time, several pages at once
+        starts = range(0, len(taxids), BATCH_SIZE)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            pages = executor.map(lambda start: self._fetch_taxa(posted, start),
+                                 starts)
+            # Drawn below the [TREE] bar, which runs at the same time
+            for records in tqdm(pages, total=len(starts),
+                                desc='[PHYLOGENIES]', position=1):
+                for taxid, lineage in records:
+                    lineages[taxid] = lineage
+                    if self._cache is not None:
+                        self._cache.set(f"taxonomy:{taxid}",
+                                        lineages[taxid])
+
+        return lineages
+
+    def _ranked_lineage(self, record: dict) -> dict:
+        """
+        Map each rank in a taxonomy record's lineage, including the taxon
+        itself, to the name of the taxon at that rank.
+        :param record: A Taxon XML element.
+        """
+        taxa = record.findall('LineageEx/Taxon') + [record]
+        return {taxon.findtext('Rank'): taxon.findtext('ScientificName')
+                for taxon in taxa}
+
+    def _fetch_taxa(self, posted: dict, start: int) -> list:
+        """
+        Fetch one page of taxonomy records from NCBI's history server.
+        Returns the taxonomy ID and ranked lineage of each record.
+        :param posted: The history parameters the taxonomy IDs were uploaded
+        under.
+        :param start: The index of the first record of the page.
+        """
+        r = eutils('efetch', {**posted, 'db': 'taxonomy', 'retstart': start,
+                              'retmax': BATCH_SIZE, 'retmode': 'xml'})
+        return [(record.findtext('TaxId'), self._ranked_lineage(record))
+                for record in iter_records(r.content, parent='TaxaSet')]
+
     def _display_pie_chart(self):
         """
         Display the pie chart of the phylogeny distribution.
         """
+        # matplotlib is slow to import, so it is only loaded when needed
+        from matplotlib import pyplot as plt
+
         # Create a pie chart of the specified rank distribution
-        plt.figure(figsize=(10, 10))
+        fig = plt.figure(figsize=(10, 10))
         plt.pie(self.ranks.values(), labels=self.ranks.keys(),
                 autopct='%1.1f%%')
         plt.title(f'{self.rank.capitalize()} Distribution')
@@ -363,38 +542,44 @@ class Tree:
         plt.savefig(filename)
 
         # Display the pie chart
-        plt.show()
+        if self.interactive:
+            plt.show()
+        else:
+            plt.close(fig)
 
-    def _parse_records(self, records: str) -> None:
+    def _parse_records(self, data: bytes) -> None:
         """
         Parse the records returned by NCBI.
-        :param records: The records returned.
+        :param data: The raw GBSeq XML returned.
         """
-        # Parse the records
-        records = Entrez.read(records)
-
         # Grab the lineages for each record
-        for record in records:
+        for record in iter_records(data, parent='GBSet'):
             # Grab the accession
-            accession = record['GBSeq_accession-version']
+            accession = record.findtext('GBSeq_accession-version')
             # Grab the lineage
-            lineage = record['GBSeq_taxonomy'].split('; ')
-            # Add the lineage to the dictionary
-            if "other sequences" or "artificial sequences" not in lineage:
+            lineage = record.findtext('GBSeq_taxonomy', '').split('; ')
+            # Only keep the lineage of natural organisms
+            if _BAD_LINEAGES.isdisjoint(lineage):
                 self.lineages[accession] = lineage
-            else:
-                # Remove the accession from the dictionary
-                del self.accessions[accession]
-
-            # Make sure the organism is included in the lineage dictionary if
-            # and only if they are natural
-            self.lineages[accession] = lineage if "other sequences" or \
-                                                  "artificial sequences" \
-                                                  not in lineage else []
             # Grab the species name
-            species = record['GBSeq_organism']
+            species = record.findtext('GBSeq_organism')
             # Add the species name to the dictionary
             self.accessions[accession] = species
+            # Grab the taxonomy ID of the species, if it is given
+            taxid = self._parse_taxid(record)
+            if taxid is not None:
+                self.taxids[accession] = taxid
+
+    def _parse_taxid(self, record):
+        """
+        Return the taxonomy ID from the source feature of a GenBank record,
+        or None if it does not have one.
+        :param record: A GBSeq XML element.
+        """
+        for value in record.iterfind(_SOURCE_XREFS):
+            if value.text and value.text.startswith('taxon:'):
+                return value.text[len('taxon:'):]
+        return None
 
     def _run_iqtree(self) -> None:
         """
@@ -408,5 +593,73 @@ class Tree:
         """
         Display the IQ-TREE using matplotlib and Biopython
         """
+        # Print the tree to the terminal when there is no display
+        if HEADLESS:
+            Phylo.draw_ascii(Phylo.read(f'{self.input}.treefile', 'newick'))
+            return
+
+        # The tree is already saved, so there is nothing to do in batch mode
+        if not self.interactive:
+            return
+
         tree = Phylo.read(f'{self.input}.treefile', 'newick')
         Phylo.draw(tree)
+
+
+def _expected_sha256():
+    """
+    Return the SHA-256 the IQ-TREE archive for this platform must match, or
+    None if there is none to check against.
+    """
+    expected = IQTREE_SHA256 or IQTREE_RELEASES[sys.platform][2]
+    return expected.strip().lower() if expected else None
+
+
+def _checked_members(tar: tarfile.TarFile, folder: str):
+    """
+    Yield the members of a tarball, raising a ValueError for any that would
+    be written outside the folder it is extracted into. Only needed where
+    tarfile has no extraction filters.
+    :param tar: The tarball being extracted.
+    :param folder: The folder the tarball is extracted into.
+    """
+    root = os.path.realpath(folder)
+    for member in tar:
+        path = os.path.realpath(os.path.join(root, member.name))
+        targets = [path]
+        if member.issym():
+            targets.append(os.path.realpath(os.path.join(
+                os.path.dirname(path), member.linkname)))
+        elif member.islnk():
+            targets.append(os.path.realpath(os.path.join(root,
+                                                         member.linkname)))
+        if member.isdev() or os.path.isabs(member.name) or \
+                any(os.path.commonpath([root, target]) != root
+                    for target in targets):
+            raise ValueError(f'Refusing to extract {member.name} from the '
+                             f'IQ-TREE archive.')
+        yield member
+
+
+class _HashingReader:
+    """
+    A file-like wrapper that feeds everything read through it to a hash.
+    """
+
+    def __init__(self, raw, digest):
+        """
+        Initialize the _HashingReader object.
+        :param raw: The file-like object to read from.
+        :param digest: The hash to update.
+        """
+        self.raw = raw
+        self.digest = digest
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read from the wrapped object and add the bytes to the hash.
+        :param size: The maximum number of bytes to read.
+        """
+        data = self.raw.read(size)
+        self.digest.update(data)
+        return data
@@ -0,0 +1,83 @@
+import os
+from io import BytesIO
+
+import requests
+from Bio import Entrez
+from dotenv import load_dotenv
+from lxml import etree
+
+from net import RateLimiter, with_retry
+
+load_dotenv()
+
+EMAIL = os.getenv("EMAIL")
+API_KEY = os.getenv("NCBI_API_KEY")
+
+EUTILS = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/{TOOL}.fcgi"
+
+# A shared session so that every request to NCBI reuses open connections.
+SESSION = requests.Session()
+
+# NCBI allows 10 requests per second with an API key and 3 without one. The
+# limits are kept slightly below these to leave room for clock jitter.
+REQUESTS_PER_SECOND = 9.5 if API_KEY else 2.9
+
+# The number of UIDs to request in a single EFetch call. Larger sets of UIDs
+# are uploaded to NCBI's history server once and paged through instead.
+BATCH_SIZE = 200
+HISTORY_BATCH_SIZE = 500
+
+_RATE = RateLimiter(REQUESTS_PER_SECOND)
+
+
+@with_retry
+def eutils(tool: str, params: dict, stream: bool = False,
+           session: requests.Session = SESSION) -> requests.Response:
+    """
+    Send a rate-limited request to one of NCBI's E-utilities. Parameters are
+    POSTed so that long ID lists do not overflow the URL.
+    :param tool: The E-utility to use, e.g. "esearch" or "efetch".
+    :param params: The parameters of the request.
+    :param stream: Whether to stream the response body.
+    :param session: The session to send the request with.
+    """
+    params = {**params, 'tool': "bridge", 'email': EMAIL, 'api_key': API_KEY}
+    _RATE.wait()
+    r = session.post(EUTILS.format(TOOL=tool), data=params, stream=stream)
+    r.raise_for_status()
+    return r
+
+
+def epost(db: str, ids: list,
+          session: requests.Session = SESSION) -> dict:
+    """
+    Upload IDs to NCBI's history server with EPost. Returns the WebEnv and
+    query key that refer to them, as EFetch parameters.
+    :param db: The database the IDs belong to.
+    :param ids: The IDs to upload.
+    :param session: The session to send the request with.
+    """
+    r = eutils("epost", {'db': db, 'id': ",".join(ids)}, session=session)
+    result = Entrez.read(BytesIO(r.content))
+    return {'WebEnv': result['WebEnv'], 'query_key': result['QueryKey']}
+
+
+def iter_records(data: bytes, tag: str = None, parent: str = None):
+    """
+    Yield each record in an EFetch XML response, discarding it once it has
+    been consumed so memory use stays flat.
+    :param data: The raw XML returned by EFetch.
+    :param tag: The tag of the records, if they all share one.
+    :param parent: The tag of the element that holds the records, if they
+    are told apart by where they sit rather than by their tag.
+    """
+    for _, element in etree.iterparse(BytesIO(data), tag=tag,
+                                      huge_tree=True):
+        # Records nested inside another record are read with it
+        if parent is not None and (element.getparent() is None or
+                                   element.getparent().tag != parent):
+            continue
+        yield element
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
@@ -0,0 +1,126 @@
+import json
+import os
+import random
+import sqlite3
+import time
+from functools import wraps
+from threading import Lock
+
+import requests
+
+# The number of requests to send at the same time.
+MAX_WORKERS = 10
+
+# Throttled (429) and server-side failures are retried with backoff.
+RETRY_ATTEMPTS = 6
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Responses are cached on disk and refetched after a week.
+CACHE_PATH = os.path.expanduser("~/.bridge_cache.sqlite")
+CACHE_TTL = 7 * 24 * 60 * 60
+
+
+class RateLimiter:
+    """
+    Spaces out requests so that no more than a set number are sent per
+    second. Safe to share between threads.
+    """
+
+    def __init__(self, rps: float):
+        """
+        Initialize a new RateLimiter.
+        :param rps: The maximum number of requests per second.
+        """
+        self.interval = 1.0 / rps
+        self._next = 0.0
+        self._lock = Lock()
+
+    def wait(self) -> None:
+        """
+        Block until another request can be sent without exceeding the limit.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def with_retry(fn, *, attempts: int = RETRY_ATTEMPTS):
+    """
+    Wrap a function making an HTTP request so that throttling, server errors,
+    timeouts, and dropped connections are retried with exponential backoff.
+    :param fn: The function to wrap.
+    :param attempts: The maximum number of times to call the function.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(attempts - 1):
+            try:
+                return fn(*args, **kwargs)
+            except requests.HTTPError as e:
+                if e.response.status_code not in RETRY_STATUSES:
+                    raise
+            except (requests.ConnectionError, requests.Timeout):
+                pass
+            time.sleep(min(60, 2 ** attempt + random.random() * 0.5))
+
+        # Let the final attempt raise if it also fails.
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
+class Cache:
+    """
+    A persistent on-disk cache of responses, keyed by query.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl: int = CACHE_TTL):
+        """
+        Open (or create) the cache database, dropping any entries that have
+        expired so the file does not grow without bound.
+        :param path: The path to the SQLite database.
+        :param ttl: The number of seconds an entry stays valid for.
+        """
+        self.ttl = ttl
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS cache ("
+                               "key TEXT PRIMARY KEY, payload BLOB, "
+                               "created REAL)")
+            self._conn.execute("DELETE FROM cache WHERE created < ?",
+                               (time.time() - ttl,))
+
+    def get(self, key: str, ttl: int = None):
+        """
+        Return the cached value for the key, or None if it is missing or has
+        expired. Expired entries are deleted.
+        :param key: The key to look up.
+        :param ttl: The number of seconds this entry stays valid for, if it
+        should expire sooner than the rest of the cache.
+        """
+        ttl = min(ttl or self.ttl, self.ttl)
+        with self._lock:
+            row = self._conn.execute("SELECT payload, created FROM cache "
+                                     "WHERE key = ?", (key,)).fetchone()
+            if row is not None and time.time() - row[1] > ttl:
+                with self._conn:
+                    self._conn.execute("DELETE FROM cache WHERE key = ?",
+                                       (key,))
+                row = None
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value) -> None:
+        """
+        Store a JSON-serializable value in the cache.
+        :param key: The key to store the value under.
+        :param value: The value to store.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                               (key, json.dumps(value), time.time()))
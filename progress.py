@@ -0,0 +1,19 @@
+from tqdm import tqdm
+
+
+def wait_with_elapsed(label: str, waiter, position: int = None) -> None:
+    """
+    Block until a task finishes, showing the time elapsed under the given
+    label. The waiter is called with a timeout of one second and returns
+    whether the task is done; since it returns as soon as the task finishes,
+    rather than up to a second later, no time is lost to polling.
+    :param label: The label of the bar, e.g. "TREE".
+    :param waiter: A function that waits up to the given number of seconds
+    for the task, returning True once it is done.
+    :param position: The line to draw the bar on, if other bars are shown
+    at the same time.
+    """
+    with tqdm(bar_format=f'[{label}] - Time elapsed:\t{{elapsed}}',
+              position=position) as pbar:
+        while not waiter(1):
+            pbar.refresh()